@@ -1,130 +1,159 @@
 # main.py
 
-from fastapi import FastAPI, HTTPException, Query
-import yfinance as yf
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, Response
+import msgpack
+from pydantic import BaseModel, Field
+import asyncio
 import os
-import json
+from pathlib import Path
+from typing import Literal
+import orjson
 import pandas as pd
+from portfolio_manager import (
+    get_current_portfolio_value,
+    lookup_symbol,
+    fetch_current_price,
+    invalidate_price,
+    download_history,
+)
+from data_utils import save_history
+
+app = FastAPI(default_response_class=ORJSONResponse)
+
+Period = Literal["1d", "5d", "1mo", "3mo", "6mo", "1y", "2y", "5y", "10y", "ytd", "max"]
+
+
+# Trades are validated before any data is fetched
+class TradeRequest(BaseModel):
+    ticker: str = Field(pattern=r"^[A-Za-z0-9.\-=^]{1,15}$")
+    quantity: int = Field(gt=0)
 
-app = FastAPI()
 
 # Load start capital from config file
-with open('config.json', 'r') as f:
-    config = json.load(f)
+config = orjson.loads(Path('config.json').read_bytes())
 
 start_capital = config['start_capital']
 portfolio = {}
 
+# Serializes trades so no other request can interleave between the price lookup and the update
+trade_lock = asyncio.Lock()
+
 # Ensure 'data' directory exists
 if not os.path.exists('data'):
     os.makedirs('data')
 
 
 @app.get("/search/{query}")
-def search_symbol(query: str):
+async def search_symbol(query: str):
     try:
-        result = yf.Ticker(query).info
+        result = await asyncio.to_thread(lookup_symbol, query.upper())
         if not result:
             raise HTTPException(status_code=404, detail="No data found for query")
         
-        return {"symbol": result.get("symbol"), "name": result.get("shortName")}
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/historical-data/{ticker}")
-def get_historical_data(ticker: str, period: str = Query("1y", pattern="^(1d|5d|1mo|3mo|6mo|1y|2y|5y|10y|ytd|max)$")):
+async def get_historical_data(ticker: str, period: Period = "1y"):
     try:
-        data = yf.download(ticker, period=period)
+        data = await asyncio.to_thread(download_history, ticker.upper(), period)
         if data.empty:
             raise HTTPException(status_code=404, detail="No data found for ticker")
         
-        file_path = f"data/{ticker}.csv"
-        data.to_csv(file_path)
+        file_path = await asyncio.to_thread(save_history, ticker.upper(), data)
         return {"message": f"Data saved to {file_path}"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/buy")
-def buy_stock(ticker: str, quantity: int):
+async def buy_stock(trade: TradeRequest):
     global start_capital, portfolio
-    data = yf.download(ticker)
-    if data.empty:
-        raise HTTPException(status_code=404, detail="Ticker not found")
-
-    current_price = data['Close'].iloc[-1]
+    ticker = trade.ticker.upper()
+    quantity = trade.quantity
+    invalidate_price(ticker)
+    current_price = await asyncio.to_thread(fetch_current_price, ticker)
     total_cost = current_price * quantity
 
-    if total_cost > start_capital:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
+    async with trade_lock:
+        if total_cost > start_capital:
+            raise HTTPException(status_code=400, detail="Insufficient funds")
 
-    start_capital -= total_cost
-    if ticker in portfolio:
-        portfolio[ticker] += quantity
-    else:
-        portfolio[ticker] = quantity
+        start_capital -= total_cost
+        if ticker in portfolio:
+            portfolio[ticker] += quantity
+        else:
+            portfolio[ticker] = quantity
 
     return {"message": f"Bought {quantity} shares of {ticker}", "remaining_capital": start_capital}
 
 
 @app.post("/sell")
-def sell_stock(ticker: str, quantity: int):
+async def sell_stock(trade: TradeRequest):
     global start_capital, portfolio
+    ticker = trade.ticker.upper()
+    quantity = trade.quantity
     if ticker not in portfolio or portfolio[ticker] < quantity:
         raise HTTPException(status_code=400, detail="Insufficient shares")
 
-    data = yf.download(ticker)
-    current_price = data['Close'].iloc[-1]
+    invalidate_price(ticker)
+    current_price = await asyncio.to_thread(fetch_current_price, ticker)
     total_revenue = current_price * quantity
 
-    start_capital += total_revenue
-    portfolio[ticker] -= quantity
+    async with trade_lock:
+        if ticker not in portfolio or portfolio[ticker] < quantity:
+            raise HTTPException(status_code=400, detail="Insufficient shares")
+
+        start_capital += total_revenue
+        portfolio[ticker] -= quantity
 
-    if portfolio[ticker] == 0:
-        del portfolio[ticker]
+        if portfolio[ticker] == 0:
+            del portfolio[ticker]
 
     return {"message": f"Sold {quantity} shares of {ticker}", "remaining_capital": start_capital}
 
 
 @app.get("/portfolio")
-def get_portfolio():
+async def get_portfolio():
     return {"portfolio": portfolio, "remaining_capital": start_capital}
 
 
 @app.get("/current-price/{ticker}")
-def get_current_price(ticker: str):
+async def get_current_price(ticker: str):
     try:
-        data = yf.download(ticker, period="1d", interval="1m")
-        if data.empty:
-            raise HTTPException(status_code=404, detail="Ticker not found")
-        current_price = data['Close'].iloc[-1]
+        current_price = await asyncio.to_thread(fetch_current_price, ticker)
         return {"ticker": ticker, "current_price": current_price}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/portfolio-value")
-def get_portfolio_value():
+async def get_portfolio_value():
     try:
-        tickers = list(portfolio.keys())
-        if not tickers:
+        if not portfolio:
             return {"total_value": 0}
 
-        total_value = 0
+        total_value = await asyncio.to_thread(get_current_portfolio_value, dict(portfolio))
+        return {"total_value": total_value}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        for ticker in tickers:
-            data = yf.download(ticker, period="1d", interval="1m")
-            if data.empty:
-                raise HTTPException(status_code=404, detail=f"Ticker {ticker} not found")
-            current_price = data['Close'].iloc[-1]
-            total_value += current_price * portfolio[ticker]
 
-        return {"total_value": total_value}
+@app.get("/state")
+async def get_state():
+    try:
+        total_value = await asyncio.to_thread(get_current_portfolio_value, dict(portfolio))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    state = {"portfolio": portfolio, "remaining_capital": float(start_capital), "total_value": float(total_value)}
+    return Response(msgpack.packb(state), media_type="application/msgpack")
+
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # The portfolio lives in memory, so keep a single worker; loop="auto" picks uvloop where installed
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="auto", http="httptools", proxy_headers=True)
\ No newline at end of file
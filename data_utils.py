@@ -0,0 +1,292 @@
+"""
+Data Utilities Module
+---------------------
+This module provides helper functions for storing and reading the ticker data files in the `data` directory.
+
+Historical data is stored as Parquet files. CSV files from earlier versions are converted on first read,
+and setting `CSV_COMPAT` keeps reading and writing CSV files instead.
+It also reads the saved portfolio file.
+
+Installation:
+    pip install pandas numpy pyarrow orjson
+
+Author: Arthur Simon, MNr: -
+Date: 02.06.2024
+license: free
+version: 0.0.1 (master.major.minor)
+"""
+
+import json
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    # orjson is optional, the standard library is used when it is not installed
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+    json_loads = json.loads
+
+DATA_DIR = "data"
+
+PORTFOLIO_FILE = "portfolio.json"
+
+# Write CSV files instead of Parquet files, for tools that still expect CSV
+CSV_COMPAT = False
+
+
+def history_path(ticker: str) -> str:
+    """
+    Get the path new historical data for a ticker is written to.
+
+    Args:
+        ticker (str): The stock or cryptocurrency ticker.
+
+    Returns:
+        str: The path of the data file. -> str
+    """
+    extension = "csv" if CSV_COMPAT else "parquet"
+    return os.path.join(DATA_DIR, f"{ticker}.{extension}")
+
+
+def find_history(ticker: str) -> str:
+    """
+    Get the path of the stored historical data for a ticker, preferring Parquet over CSV.
+
+    Args:
+        ticker (str): The stock or cryptocurrency ticker.
+
+    Returns:
+        str: The path of the existing data file. -> str
+
+    Raises:
+        FileNotFoundError: If no data file exists for the ticker.
+    """
+    return _stat_history(ticker)[0]
+
+
+def _stat_history(ticker: str) -> tuple:
+    """
+    Find the stored historical data for a ticker with one `os.stat` call per candidate file.
+
+    Args:
+        ticker (str): The stock or cryptocurrency ticker.
+
+    Returns:
+        tuple: The path of the existing data file and its stat result. -> (str, os.stat_result)
+
+    Raises:
+        FileNotFoundError: If no data file exists for the ticker.
+    """
+    for extension in ("parquet", "csv"):
+        file_path = os.path.join(DATA_DIR, f"{ticker}.{extension}")
+        try:
+            return file_path, os.stat(file_path)
+        except FileNotFoundError:
+            continue
+    raise FileNotFoundError(f"No historical data found for {ticker}")
+
+
+def history_exists(ticker: str) -> bool:
+    """
+    Check whether historical data is stored for a ticker.
+
+    Args:
+        ticker (str): The stock or cryptocurrency ticker.
+
+    Returns:
+        bool: True if a data file exists. -> bool
+    """
+    try:
+        find_history(ticker)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def save_history(ticker: str, data: pd.DataFrame) -> str:
+    """
+    Save historical data for a ticker, replacing any previously stored file.
+
+    Args:
+        ticker (str): The stock or cryptocurrency ticker.
+        data (pd.DataFrame): The data downloaded from yfinance, indexed by date.
+
+    Returns:
+        str: The path of the written file. -> str
+
+    Tests:
+        1. Test saving a DataFrame to verify `load_history` returns the same data.
+        2. Test saving over an existing CSV file to verify only the new file remains.
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    file_path = history_path(ticker)
+    if CSV_COMPAT:
+        _write_csv(file_path, data)
+    else:
+        data.to_parquet(file_path, engine="pyarrow", compression="zstd")
+
+    # Remove the file in the other format so readers do not pick up stale data
+    for extension in ("parquet", "csv"):
+        other_path = os.path.join(DATA_DIR, f"{ticker}.{extension}")
+        if other_path != file_path and os.path.exists(other_path):
+            os.remove(other_path)
+    return file_path
+
+
+def _write_csv(file_path: str, data: pd.DataFrame) -> None:
+    """
+    Write historical data as CSV, formatting plain Python values instead of going through the pandas writer.
+
+    Produces the same layout as `DataFrame.to_csv`: the index first, floats in their shortest exact form
+    and missing values as empty fields.
+
+    Args:
+        file_path (str): The path of the CSV file.
+        data (pd.DataFrame): The data downloaded from yfinance, indexed by date.
+
+    Returns:
+        None -> None
+    """
+    fields = [data.index.astype(str).tolist()]
+    for name in data.columns:
+        values = data[name].to_numpy()
+        if values.dtype.kind == "f":
+            # NaN is the only value that is not equal to itself
+            fields.append([repr(value) if value == value else "" for value in values.tolist()])
+        else:
+            fields.append(list(map(str, values.tolist())))
+
+    header = ",".join([str(data.index.name or ""), *map(str, data.columns)])
+    with open(file_path, "w", newline="") as f:
+        f.write(header + "\n")
+        f.writelines(",".join(row) + "\n" for row in zip(*fields))
+
+
+def migrate_csv_files() -> list:
+    """
+    Convert all CSV files from earlier versions in the data directory to Parquet.
+
+    Does nothing when `CSV_COMPAT` is set.
+
+    Returns:
+        list: The tickers whose files were converted. -> list
+
+    Tests:
+        1. Test with CSV files in the data directory to verify each is replaced by a Parquet file.
+        2. Test with `CSV_COMPAT` set to verify the CSV files are kept.
+    """
+    if CSV_COMPAT or not os.path.isdir(DATA_DIR):
+        return []
+
+    converted = []
+    for name in os.listdir(DATA_DIR):
+        if name.endswith(".csv"):
+            ticker = name[:-len(".csv")]
+            try:
+                load_history(ticker)
+            except (ValueError, KeyError):
+                # Leave unreadable files alone, they fail with a clear error when the ticker is used
+                continue
+            converted.append(ticker)
+    return converted
+
+
+def load_history(ticker: str, columns: list = None) -> pd.DataFrame:
+    """
+    Load the stored historical data for a ticker.
+
+    A CSV file from an earlier version is converted to Parquet on first read unless `CSV_COMPAT` is set.
+    The parsed data is cached until the file changes, so the returned DataFrame must not be modified.
+
+    Args:
+        ticker (str): The stock or cryptocurrency ticker.
+        columns (list): The columns to read, all columns if None.
+
+    Returns:
+        pd.DataFrame: The historical data indexed by date. -> pd.DataFrame
+
+    Raises:
+        FileNotFoundError: If no data file exists for the ticker.
+
+    Tests:
+        1. Test with a ticker stored as Parquet to verify only the requested columns are returned.
+        2. Test with a ticker stored as CSV to verify it is replaced by a Parquet file with the same data.
+        3. Test loading twice to verify the second call does not read the file again.
+    """
+    file_path, stat = _stat_history(ticker)
+    if file_path.endswith(".csv") and not CSV_COMPAT:
+        file_path = save_history(ticker, _read_history(file_path, stat.st_mtime_ns, None))
+        stat = os.stat(file_path)
+    columns = None if columns is None else tuple(columns)
+    return _read_history(file_path, stat.st_mtime_ns, columns)
+
+
+@lru_cache(maxsize=64)
+def _read_history(file_path: str, mtime_ns: int, columns: tuple) -> pd.DataFrame:
+    """
+    Parse a historical data file, cached per modification time so unchanged files are not parsed again.
+
+    Args:
+        file_path (str): The path to the Parquet or CSV file.
+        mtime_ns (int): The modification time of the file, part of the cache key.
+        columns (tuple): The columns to read, all columns if None.
+
+    Returns:
+        pd.DataFrame: The historical data indexed by date. -> pd.DataFrame
+    """
+    if file_path.endswith(".parquet"):
+        return pd.read_parquet(file_path, columns=None if columns is None else list(columns))
+    usecols = dtype = None
+    if columns is not None:
+        usecols = ["Date", *columns]
+        # Declared types spare the parser inferring them; only "Volume" is not a price column
+        dtype = {column: "float64" for column in columns if column != "Volume"}
+    # The multithreaded pyarrow parser only builds the selected columns; the dates are converted once afterwards
+    data = pd.read_csv(file_path, engine="pyarrow", usecols=usecols, dtype=dtype)
+    # The ISO 8601 fast path parses both plain dates and timestamps with UTC offsets without dateutil
+    data["Date"] = pd.to_datetime(data["Date"], format="ISO8601")
+    return data.set_index("Date")
+
+
+def load_closes(ticker: str) -> np.ndarray:
+    """
+    Load all closing prices of a ticker.
+
+    Args:
+        ticker (str): The stock or cryptocurrency ticker.
+
+    Returns:
+        np.ndarray: The closing prices in chronological order, without missing values. -> np.ndarray
+
+    Raises:
+        FileNotFoundError: If no data file exists for the ticker.
+
+    Tests:
+        1. Test with a stored ticker to verify the last element matches the last closing price.
+        2. Test with a file that only contains the header to verify an empty array is returned.
+    """
+    return load_history(ticker, columns=["Close"])["Close"].dropna().to_numpy(dtype=np.float64)
+
+
+def read_portfolio_file() -> dict:
+    """
+    Read the saved portfolio.
+
+    Returns:
+        dict: The saved start capital and portfolio. -> {"start_capital": float, "portfolio": dict}
+
+    Raises:
+        FileNotFoundError: If the portfolio file does not exist.
+        json.JSONDecodeError: If the portfolio file is corrupted.
+
+    Tests:
+        1. Test reading a saved portfolio to verify the start capital and portfolio are returned.
+        2. Test with a missing file to verify it raises FileNotFoundError.
+    """
+    with open(PORTFOLIO_FILE, "rb") as f:
+        return json_loads(f.read())
@@ -1,13 +1,62 @@
 # trading_simulator.py
 
+import asyncio
+import os
+import threading
 import tkinter as tk
 from tkinter import messagebox, ttk
-import requests
-import json
-import matplotlib.pyplot as plt
+import httpx
+import msgpack
+import orjson
+import numpy as np
 import pandas as pd
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from datetime import datetime
+from matplotlib.figure import Figure
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from data_utils import find_history, load_history
+
+API_URL = "http://127.0.0.1:8000"
+
+# Number of daily rows in periods counted in trading days, which calendar time does not match
+# over weekends, holidays and before the market opens
+PERIOD_TO_ROWS = {
+    "1d": 1,
+    "5d": 5,
+}
+
+# Time span covered by each other selectable period, "ytd" and "max" are handled separately
+PERIOD_TO_DELTA = {
+    "1mo": timedelta(days=30),
+    "3mo": timedelta(days=91),
+    "6mo": timedelta(days=182),
+    "1y": timedelta(days=365),
+    "2y": timedelta(days=730),
+    "5y": timedelta(days=1826),
+    "10y": timedelta(days=3652),
+}
+
+@lru_cache(maxsize=128)
+def _load_close(ticker, mtime):
+    # The file's mtime is part of the key, so a rewritten data file is read again
+    return load_history(ticker, columns=["Close"])
+
+def load_close(ticker):
+    return _load_close(ticker, os.path.getmtime(find_history(ticker)))
+
+@lru_cache(maxsize=8)
+def _invested_value(holdings, mtimes):
+    # Align all close series on one date index, carrying prices over non-trading days
+    closes = pd.concat({ticker: load_close(ticker)['Close'] for ticker, _ in holdings}, axis=1).ffill().dropna()
+    quantities = np.array([quantity for _, quantity in holdings])
+    return closes.index, closes.to_numpy() @ quantities
+
+def invested_value(holdings):
+    # Unchanged holdings and data files reuse the computed series instead of rebuilding it per refresh
+    holdings = tuple(sorted(holdings.items()))
+    mtimes = tuple(os.path.getmtime(find_history(ticker)) for ticker, _ in holdings)
+    return _invested_value(holdings, mtimes)
 
 class TradingSimulator(tk.Tk):
     def __init__(self):
@@ -18,6 +67,13 @@ class TradingSimulator(tk.Tk):
 
         self.remaining_capital = self.load_start_capital()
         self.portfolio_value = 0  # Set initial portfolio value to 0
+        self.downloaded_periods = {}  # Period last downloaded in this session, per ticker
+
+        # Backend requests run on an asyncio loop in a background thread so the GUI never blocks
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        self._client = httpx.AsyncClient(base_url=API_URL, timeout=30)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Create a canvas to add scrollbars
         self.canvas = tk.Canvas(self, bg="lightgrey")
@@ -64,6 +120,9 @@ class TradingSimulator(tk.Tk):
 
         self.plot_frame = tk.Frame(self.frame, bg="lightgrey")
         self.plot_frame.pack(pady=20)
+        # Figure and canvas for the historical data, embedded by the first plot and reused afterwards
+        self._hist_fig = None
+        self._hist_canvas = None
 
         self.quantity_label = tk.Label(self.frame, text="Enter Quantity:", bg="lightgrey", font=("Arial", 12))
         self.quantity_label.pack(pady=10)
@@ -83,6 +142,21 @@ class TradingSimulator(tk.Tk):
         self.portfolio_plot_frame = tk.Frame(self.frame, bg="lightgrey")
         self.portfolio_plot_frame.pack(pady=20)
 
+        # The portfolio figure is created once; refreshes only redraw its line by blitting
+        self._fig = Figure(figsize=(10, 5))
+        self._ax = self._fig.add_subplot(111)
+        self._line, = self._ax.plot([], [], label="Invested Value", animated=True)
+        self._ax.xaxis_date()
+        self._ax.set_title("Total Invested Value Over Time")
+        self._ax.set_xlabel("Date")
+        self._ax.set_ylabel("Value")
+        self._ax.legend()
+        self._ax.grid(True)
+        self._canvas = FigureCanvasTkAgg(self._fig, master=self.portfolio_plot_frame)
+        self._canvas.mpl_connect("draw_event", self.on_portfolio_draw)
+        self._canvas.draw()
+        self._canvas.get_tk_widget().pack()
+
         self.capital_label = tk.Label(self.frame, text=f"Remaining Capital: ${self.remaining_capital:.2f}", bg="lightgrey", font=("Arial", 12))
         self.capital_label.pack(pady=10)
 
@@ -95,146 +169,218 @@ class TradingSimulator(tk.Tk):
         self.portfolio_change_label = tk.Label(self.portfolio_value_frame, text="", bg="lightgrey", font=("Arial", 12))
         self.portfolio_change_label.pack(side=tk.LEFT, padx=5)
 
+    def run_async(self, coro, callback):
+        # Run coro on the background loop and pass its result to callback on the Tk thread
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        self._wait_for(future, callback)
+
+    def _wait_for(self, future, callback):
+        if future.done():
+            callback(future.result())
+        else:
+            self.after(20, self._wait_for, future, callback)
+
+    def on_close(self):
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self.destroy()
+
     def load_start_capital(self):
-        with open('config.json', 'r') as f:
-            config = json.load(f)
+        config = orjson.loads(Path('config.json').read_bytes())
         return config['start_capital']
 
     def search_symbol(self):
         query = self.query_entry.get()
-        response = requests.get(f"http://127.0.0.1:8000/search/{query}")
+        self.run_async(self._client.get(f"/search/{query}"), self.on_search_result)
+
+    def on_search_result(self, response):
         if response.status_code == 200:
-            result = response.json()
+            result = orjson.loads(response.content)
             symbol = result['symbol']
             name = result['name']
             messagebox.showinfo("Search Result", f"Symbol: {symbol}\nName: {name}")
             self.query_entry.delete(0, tk.END)
             self.query_entry.insert(0, symbol)
         else:
-            messagebox.showerror("Error", response.json()['detail'])
+            messagebox.showerror("Error", orjson.loads(response.content)['detail'])
 
     def get_historical_data(self):
         ticker = self.query_entry.get()
         period = self.time_period_var.get()
-        response = requests.get(f"http://127.0.0.1:8000/historical-data/{ticker}?period={period}")
+        self.run_async(
+            self._client.get(f"/historical-data/{ticker}", params={"period": period}),
+            lambda response: self.on_historical_data(response, ticker, period),
+        )
+
+    def on_historical_data(self, response, ticker, period):
         if response.status_code == 200:
-            messagebox.showinfo("Success", response.json()['message'])
-            self.plot_historical_data(ticker, period)
+            self.downloaded_periods[ticker] = period
+            messagebox.showinfo("Success", orjson.loads(response.content)['message'])
+            self.plot_historical_data(ticker, period, refetch=False)
         else:
-            messagebox.showerror("Error", response.json()['detail'])
+            messagebox.showerror("Error", orjson.loads(response.content)['detail'])
 
     def on_period_change(self, event):
-        self.get_historical_data()
-
-    def plot_historical_data(self, ticker, period):
-        for widget in self.plot_frame.winfo_children():
-            widget.destroy()
-
+        ticker = self.query_entry.get()
+        period = self.time_period_var.get()
+        if self.has_local_data(ticker, period):
+            self.plot_historical_data(ticker, period)
+        else:
+            self.get_historical_data()
+
+    def period_cutoff(self, period):
+        if period == "max":
+            return None
+        if period == "ytd":
+            return datetime(datetime.now().year, 1, 1)
+        return datetime.now() - PERIOD_TO_DELTA[period]
+
+    def has_local_data(self, ticker, period):
+        # Only data downloaded in this session is recent enough to be sliced locally
+        downloaded_period = self.downloaded_periods.get(ticker)
+        if downloaded_period is None:
+            return False
+        if downloaded_period == "max":
+            return True
         try:
-            data = pd.read_csv(f"data/{ticker}.csv", index_col="Date", parse_dates=True)
-            fig, ax = plt.subplots(figsize=(10, 5))
-            data["Close"].plot(ax=ax, title=f"{ticker} Closing Prices")
-            ax.set_xlabel("Date")
-            ax.set_ylabel("Price")
-            ax.grid(True)
-
-            canvas = FigureCanvasTkAgg(fig, master=self.plot_frame)
-            canvas.draw()
-            canvas.get_tk_widget().pack()
+            data = load_close(ticker)
+        except FileNotFoundError:
+            return False
+        if period in PERIOD_TO_ROWS:
+            return len(data) >= PERIOD_TO_ROWS[period]
+        cutoff = self.period_cutoff(period)
+        if cutoff is None:
+            return False
+        return data.index[0] <= cutoff
+
+    def slice_period(self, data, period):
+        if period in PERIOD_TO_ROWS:
+            return data.iloc[-PERIOD_TO_ROWS[period]:]
+        cutoff = self.period_cutoff(period)
+        if cutoff is None:
+            return data
+        return data.loc[cutoff:]
+
+    def plot_historical_data(self, ticker, period, refetch=True):
+        try:
+            data = load_close(ticker)
         except FileNotFoundError:
             messagebox.showerror("Error", "Historical data file not found. Please fetch the data first.")
+            return
+
+        data = self.slice_period(data, period)
+        if data["Close"].dropna().empty:
+            # Nothing to plot for this period locally, so ask the server once instead of clearing the chart
+            if refetch:
+                self.get_historical_data()
+            else:
+                messagebox.showerror("Error", f"No data available for {ticker} in this period.")
+            return
+
+        if self._hist_canvas is None:
+            self._hist_fig = Figure(figsize=(10, 5))
+            self._hist_fig.add_subplot(111)
+            self._hist_canvas = FigureCanvasTkAgg(self._hist_fig, master=self.plot_frame)
+            self._hist_canvas.get_tk_widget().pack()
+
+        # Clear and redraw the axes in the existing canvas instead of rebuilding the widget
+        ax = self._hist_fig.axes[0]
+        ax.cla()
+        data["Close"].plot(ax=ax, title=f"{ticker} Closing Prices")
+        ax.set_xlabel("Date")
+        ax.set_ylabel("Price")
+        ax.grid(True)
+        self._hist_canvas.draw_idle()
 
     def buy_stock(self):
         ticker = self.query_entry.get()
-        quantity = self.quantity_entry.get()
-        if not quantity.isdigit():
+        try:
+            quantity = int(self.quantity_entry.get())
+        except ValueError:
+            quantity = 0
+        if quantity <= 0:
             messagebox.showerror("Error", "Please enter a valid quantity.")
             return
 
-        quantity = int(quantity)
-        response = requests.post(f"http://127.0.0.1:8000/buy", params={"ticker": ticker, "quantity": quantity})
-        if response.status_code == 200:
-            messagebox.showinfo("Success", response.json()['message'])
-            self.show_portfolio()  # Update the portfolio after buying
-        else:
-            messagebox.showerror("Error", response.json()['detail'])
+        self.run_async(self._client.post("/buy", json={"ticker": ticker, "quantity": quantity}), self.on_transaction)
 
     def sell_stock(self):
         ticker = self.query_entry.get()
-        quantity = self.quantity_entry.get()
-        if not quantity.isdigit():
+        try:
+            quantity = int(self.quantity_entry.get())
+        except ValueError:
+            quantity = 0
+        if quantity <= 0:
             messagebox.showerror("Error", "Please enter a valid quantity.")
             return
 
-        quantity = int(quantity)
-        response = requests.post(f"http://127.0.0.1:8000/sell", params={"ticker": ticker, "quantity": quantity})
+        self.run_async(self._client.post("/sell", json={"ticker": ticker, "quantity": quantity}), self.on_transaction)
+
+    def on_transaction(self, response):
         if response.status_code == 200:
-            messagebox.showinfo("Success", response.json()['message'])
-            self.show_portfolio()  # Update the portfolio after selling
+            messagebox.showinfo("Success", orjson.loads(response.content)['message'])
+            self.show_portfolio()  # Update the portfolio after buying or selling
         else:
-            messagebox.showerror("Error", response.json()['detail'])
+            messagebox.showerror("Error", orjson.loads(response.content)['detail'])
 
     def show_portfolio(self):
-        response = requests.get(f"http://127.0.0.1:8000/portfolio")
+        # /state returns the holdings, capital and total value in one MessagePack response
+        self.run_async(self._client.get("/state"), self.on_state)
+
+    def on_state(self, response):
         if response.status_code == 200:
-            portfolio = response.json()
+            portfolio = msgpack.unpackb(response.content, raw=False)
+            self.show_portfolio_value(portfolio['total_value'])
             self.remaining_capital = portfolio['remaining_capital']
             self.capital_label.config(text=f"Remaining Capital: ${self.remaining_capital:.2f}")
             self.plot_portfolio(portfolio)
         else:
-            messagebox.showerror("Error", response.json()['detail'])
+            messagebox.showerror("Error", orjson.loads(response.content)['detail'])
 
-    def plot_portfolio(self, portfolio):
-        for widget in self.portfolio_plot_frame.winfo_children():
-            widget.destroy()
+    def on_portfolio_draw(self, event):
+        # After every full redraw, keep the background without the line for later blits
+        self._background = self._canvas.copy_from_bbox(self._fig.bbox)
+        self._ax.draw_artist(self._line)
 
-        total_invested_value = 0
+    def plot_portfolio(self, portfolio):
         tickers = list(portfolio['portfolio'].keys())
 
-        fig, ax = plt.subplots(figsize=(10, 5))
-
         if not tickers:
-            ax.plot([datetime.now()], [0], label="Invested Value")
-            ax.set_title("Total Invested Value Over Time")
-            ax.set_xlabel("Date")
-            ax.set_ylabel("Value")
-            ax.legend()
-            ax.grid(True)
+            self._line.set_data([datetime.now()], [0])
+        else:
+            self._line.set_data(*invested_value(portfolio['portfolio']))
+
+        limits = (self._ax.get_xlim(), self._ax.get_ylim())
+        self._ax.relim()
+        self._ax.autoscale_view()
+        if (self._ax.get_xlim(), self._ax.get_ylim()) != limits:
+            # New limits change the axis ticks, so the whole figure has to be redrawn
+            self._canvas.draw()
         else:
-            for ticker in tickers:
-                quantity = portfolio['portfolio'][ticker]
-                data = pd.read_csv(f"data/{ticker}.csv", index_col="Date", parse_dates=True)
-                current_price = data['Close'].iloc[-1]
-                total_invested_value += current_price * quantity
-
-            ax.plot(data.index, [total_invested_value] * len(data.index), label="Invested Value")
-            ax.set_title("Total Invested Value Over Time")
-            ax.set_xlabel("Date")
-            ax.set_ylabel("Value")
-            ax.legend()
-            ax.grid(True)
-
-        canvas = FigureCanvasTkAgg(fig, master=self.portfolio_plot_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack()
+            self._canvas.restore_region(self._background)
+            self._ax.draw_artist(self._line)
+            self._canvas.blit(self._ax.bbox)
 
     def update_portfolio_value(self):
-        response = requests.get(f"http://127.0.0.1:8000/portfolio-value")
+        self.run_async(self._client.get("/portfolio-value"), self.on_portfolio_value)
+        self.after(60000, self.update_portfolio_value)  # Continue the periodic update every minute
+
+    def on_portfolio_value(self, response):
         if response.status_code == 200:
-            total_invested_value = response.json()['total_value']
-            self.portfolio_value_label.config(text=f"Portfolio Value: ${total_invested_value:.2f}")
-
-            change = total_invested_value - self.previous_portfolio_value
-            if change > 0:
-                self.portfolio_change_label.config(text=f"↑ ${change:.2f}", fg="green")
-            elif change < 0:
-                self.portfolio_change_label.config(text=f"↓ ${-change:.2f}", fg="red")
-            else:
-                self.portfolio_change_label.config(text="")
+            self.show_portfolio_value(orjson.loads(response.content)['total_value'])
 
-            self.previous_portfolio_value = total_invested_value
+    def show_portfolio_value(self, total_invested_value):
+        self.portfolio_value_label.config(text=f"Portfolio Value: ${total_invested_value:.2f}")
 
-        self.after(60000, self.update_portfolio_value)  # Continue the periodic update every minute
+        change = total_invested_value - self.previous_portfolio_value
+        if change > 0:
+            self.portfolio_change_label.config(text=f"↑ ${change:.2f}", fg="green")
+        elif change < 0:
+            self.portfolio_change_label.config(text=f"↓ ${-change:.2f}", fg="red")
+        else:
+            self.portfolio_change_label.config(text="")
+
+        self.previous_portfolio_value = total_invested_value
 
 if __name__ == "__main__":
     app = TradingSimulator()
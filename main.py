@@ -5,7 +5,7 @@ This module implements a backend for a portfolio management system using FastAPI
 It uses `yfinance` to fetch financial data and `pandas` for data processing.
 
 Installation:
-    pip install fastapi uvicorn yfinance pandas
+    pip install fastapi uvicorn orjson msgpack yfinance pandas pyarrow
 
 Author: Arthur Simon, MNr: -
 Date: 02.06.2024
@@ -13,27 +13,75 @@ license: free
 version: 0.0.1 (master.major.minor)
 """
 
-from fastapi import FastAPI, HTTPException, Query
-import yfinance as yf
-import pandas as pd
-import os
+import asyncio
+import logging
+import time
+from typing import Literal
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse, Response
+import msgpack
+from pydantic import BaseModel, Field
 from portfolio_manager import (
     load_portfolio,
-    save_portfolio,
+    append_transaction,
     get_current_portfolio_value,
     fetch_portfolio_data,
+    lookup_symbol,
+    prefetch_symbol_info,
+    fetch_current_price,
+    invalidate_price,
+    download_history,
 )
+from data_utils import load_closes, migrate_csv_files, save_history
+
+app = FastAPI(default_response_class=ORJSONResponse)
+logger = logging.getLogger(__name__)
+
+# Periods accepted by yfinance, validated by set membership instead of a regular expression
+Period = Literal["1d", "5d", "1mo", "3mo", "6mo", "1y", "2y", "5y", "10y", "ytd", "max"]
+
+
+class TradeRequest(BaseModel):
+    """
+    Request body for buying or selling shares, validated before any data is fetched.
+
+    Attributes:
+        ticker (str): The stock or cryptocurrency ticker.
+        quantity (int): The number of shares to trade, must be positive.
+    """
+
+    ticker: str = Field(pattern=r"^[A-Za-z0-9.\-=^]{1,15}$")
+    quantity: int = Field(gt=0)
 
-app = FastAPI()
 
 start_capital, portfolio = load_portfolio()
 
-# Fetch data for all tickers in the portfolio on startup
+# Serializes trades so no other request can interleave between the price lookup and the update
+trade_lock = asyncio.Lock()
+
+# Incremented on every trade; together with the start time it identifies a state of the portfolio
+portfolio_version = 0
+server_start = f"{time.time_ns():x}"
+
+# Convert data files from earlier versions once, then fetch data for all tickers in the portfolio on startup
+migrate_csv_files()
 fetch_portfolio_data(portfolio)
+prefetch_symbol_info(portfolio)
+
+# Closing prices per ticker, kept in memory so trades do not have to re-read the data files
+closing_prices = {}
+for ticker in portfolio:
+    try:
+        closing_prices[ticker] = load_closes(ticker)
+    except FileNotFoundError:
+        continue
+    except (ValueError, KeyError) as e:
+        # An unreadable file must not stop the server; buying the ticker reports the error instead
+        logger.warning("Skipping unreadable historical data for %s: %s", ticker, e)
 
 
 @app.get("/search/{query}")
-def search_symbol(query: str) -> dict:
+async def search_symbol(query: str) -> dict:
     """
     Search for a stock symbol and return its details.
 
@@ -51,23 +99,21 @@ def search_symbol(query: str) -> dict:
         2. Test with an invalid stock symbol (e.g., "INVALID") to verify it raises a 404 HTTPException.
     """
     try:
-        result = yf.Ticker(query.upper()).info
+        result = await asyncio.to_thread(lookup_symbol, query.upper())
         if not result:
             raise HTTPException(status_code=404, detail="No data found for query")
-        return {"symbol": result.get("symbol"), "name": result.get("shortName")}
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/historical-data/{ticker}")
-def get_historical_data(
+async def get_historical_data(
     ticker: str,
-    period: str = Query(
-        "1y", pattern="^(1d|5d|1mo|3mo|6mo|1y|2y|5y|10y|ytd|max)$"
-    ),
+    period: Period = "1y",
 ) -> dict:
     """
-    Get historical data for a given stock ticker and save it as a CSV file.
+    Get historical data for a given stock ticker and save it to the data directory.
 
     Args:
         ticker (str): The stock ticker to fetch data for.
@@ -84,61 +130,71 @@ def get_historical_data(
         2. Test with an invalid ticker (e.g., "INVALID") to verify it raises a 404 HTTPException.
     """
     try:
-        data = yf.download(ticker.upper(), period=period)
+        data = await asyncio.to_thread(download_history, ticker.upper(), period)
         if data.empty:
             raise HTTPException(status_code=404, detail="No data found for ticker")
 
-        file_path = f"data/{ticker.upper()}.csv"
-        data.to_csv(file_path)
+        file_path = await asyncio.to_thread(save_history, ticker.upper(), data)
+        closing_prices[ticker.upper()] = data["Close"].dropna().to_numpy(dtype="float64")
         return {"message": f"Data saved to {file_path}"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/buy")
-def buy_stock(ticker: str, quantity: int) -> dict:
+async def buy_stock(trade: TradeRequest) -> dict:
     """
     Buy a specified quantity of a stock.
 
     Args:
-        ticker (str): The stock ticker to buy.
-        quantity (int): The quantity of shares to buy.
+        trade (TradeRequest): The stock ticker and the quantity of shares to buy.
 
     Returns:
         dict: A message indicating the purchase details, remaining capital, total portfolio value, and updated portfolio. -> {"message": str, "remaining_capital": float, "total_value": float, "portfolio": dict}
 
     Raises:
-        HTTPException: If historical data is not fetched, ticker not found, or insufficient funds.
+        HTTPException: If historical data is not fetched or unreadable, ticker not found, or insufficient funds.
 
     Tests:
         1. Test buying a valid stock (e.g., "AAPL") with sufficient funds to verify the purchase is successful.
         2. Test buying a stock (e.g., "AAPL") with insufficient funds to verify it raises a 400 HTTPException.
     """
-    global start_capital, portfolio
-    ticker = ticker.upper()
-    file_path = f"data/{ticker}.csv"
-
-    if not os.path.exists(file_path):
-        raise HTTPException(
-            status_code=400,
-            detail="Please fetch the historical data for this ticker before making a purchase.",
-        )
-
-    data = pd.read_csv(file_path)
-    if data.empty:
+    global start_capital, portfolio, portfolio_version
+    ticker = trade.ticker.upper()
+    quantity = trade.quantity
+    if ticker not in closing_prices:
+        try:
+            closing_prices[ticker] = await asyncio.to_thread(load_closes, ticker)
+        except FileNotFoundError:
+            raise HTTPException(
+                status_code=400,
+                detail="Please fetch the historical data for this ticker before making a purchase.",
+            )
+        except (ValueError, KeyError):
+            raise HTTPException(
+                status_code=500,
+                detail="The historical data for this ticker could not be read. Please fetch it again.",
+            )
+
+    if not len(closing_prices[ticker]):
         raise HTTPException(status_code=404, detail="Ticker not found")
 
-    current_price = data["Close"].iloc[-1]
+    current_price = float(closing_prices[ticker][-1])
     total_cost = current_price * quantity
 
-    if total_cost > start_capital:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
+    async with trade_lock:
+        if total_cost > start_capital:
+            raise HTTPException(status_code=400, detail="Insufficient funds")
 
-    start_capital -= total_cost
-    portfolio[ticker] = portfolio.get(ticker, 0) + quantity
-    save_portfolio(start_capital, portfolio)
+        start_capital -= total_cost
+        portfolio[ticker] = portfolio.get(ticker, 0) + quantity
+        portfolio_version += 1
+        # The log write ends in an fsync, which must not block the event loop
+        await asyncio.to_thread(append_transaction, "buy", ticker, quantity, current_price, start_capital, portfolio)
 
-    total_value = get_current_portfolio_value(portfolio)
+    invalidate_price(ticker)
+
+    total_value = await asyncio.to_thread(get_current_portfolio_value, dict(portfolio))
 
     return {
         "message": f"Bought {quantity} shares of {ticker}",
@@ -149,13 +205,12 @@ def buy_stock(ticker: str, quantity: int) -> dict:
 
 
 @app.post("/sell")
-def sell_stock(ticker: str, quantity: int) -> dict:
+async def sell_stock(trade: TradeRequest) -> dict:
     """
     Sell a specified quantity of a stock.
 
     Args:
-        ticker (str): The stock ticker to sell.
-        quantity (int): The quantity of shares to sell.
+        trade (TradeRequest): The stock ticker and the quantity of shares to sell.
 
     Returns:
         dict: A message indicating the sale details, remaining capital, total portfolio value, and updated portfolio. -> {"message": str, "remaining_capital": float, "total_value": float, "portfolio": dict}
@@ -167,24 +222,32 @@ def sell_stock(ticker: str, quantity: int) -> dict:
         1. Test selling a valid stock (e.g., "AAPL") with sufficient shares to verify the sale is successful.
         2. Test selling a stock (e.g., "AAPL") with insufficient shares to verify it raises a 400 HTTPException.
     """
-    global start_capital, portfolio
-    ticker = ticker.upper()
+    global start_capital, portfolio, portfolio_version
+    ticker = trade.ticker.upper()
+    quantity = trade.quantity
     if ticker not in portfolio or portfolio[ticker] < quantity:
         raise HTTPException(status_code=400, detail="Insufficient shares")
 
-    data = yf.download(ticker)
-    current_price = data["Close"].iloc[-1]
+    # Fetch the quote before taking the lock, so other trades do not wait for the Yahoo round-trip
+    invalidate_price(ticker)
+    current_price = await asyncio.to_thread(fetch_current_price, ticker)
     total_revenue = current_price * quantity
 
-    start_capital += total_revenue
-    portfolio[ticker] -= quantity
+    async with trade_lock:
+        # Another trade may have sold the shares while the quote was fetched
+        if ticker not in portfolio or portfolio[ticker] < quantity:
+            raise HTTPException(status_code=400, detail="Insufficient shares")
+
+        start_capital += total_revenue
+        portfolio[ticker] -= quantity
 
-    if portfolio[ticker] == 0:
-        del portfolio[ticker]
+        if portfolio[ticker] == 0:
+            del portfolio[ticker]
 
-    save_portfolio(start_capital, portfolio)
+        portfolio_version += 1
+        await asyncio.to_thread(append_transaction, "sell", ticker, quantity, current_price, start_capital, portfolio)
 
-    total_value = get_current_portfolio_value(portfolio)
+    total_value = await asyncio.to_thread(get_current_portfolio_value, dict(portfolio))
 
     return {
         "message": f"Sold {quantity} shares of {ticker}",
@@ -195,22 +258,34 @@ def sell_stock(ticker: str, quantity: int) -> dict:
 
 
 @app.get("/portfolio")
-def get_portfolio() -> dict:
+async def get_portfolio(request: Request) -> Response:
     """
     Get the current portfolio details.
 
+    The response carries an ETag; a request whose If-None-Match header matches it gets an empty 304 response.
+
+    Args:
+        request (Request): The incoming request, checked for an If-None-Match header.
+
     Returns:
-        dict: The current portfolio and remaining capital. -> {"portfolio": dict, "remaining_capital": float}
+        Response: The current portfolio and remaining capital. -> {"portfolio": dict, "remaining_capital": float}
 
     Tests:
         1. Test retrieving the portfolio when it has stocks to verify it returns the correct details.
         2. Test retrieving the portfolio when it is empty to verify it returns the correct details.
+        3. Test repeating the request with the returned ETag to verify it returns 304 until the next trade.
     """
-    return {"portfolio": portfolio, "remaining_capital": start_capital}
+    etag = f'"{server_start}-{portfolio_version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return ORJSONResponse(
+        {"portfolio": portfolio, "remaining_capital": start_capital},
+        headers={"ETag": etag},
+    )
 
 
 @app.get("/portfolio-value")
-def get_portfolio_value() -> dict:
+async def get_portfolio_value() -> dict:
     """
     Get the current total value of the portfolio.
 
@@ -225,13 +300,43 @@ def get_portfolio_value() -> dict:
         2. Test retrieving the portfolio value with an empty portfolio to verify it returns 0 or an appropriate value.
     """
     try:
-        total_value = get_current_portfolio_value(portfolio)
+        total_value = await asyncio.to_thread(get_current_portfolio_value, dict(portfolio))
         return {"total_value": total_value}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/state")
+async def get_state() -> Response:
+    """
+    Get the portfolio, remaining capital and total value in a single MessagePack encoded response.
+
+    Returns:
+        Response: The MessagePack encoded state. -> {"portfolio": dict, "remaining_capital": float, "total_value": float}
+
+    Raises:
+        HTTPException: If there is an error fetching the portfolio value.
+
+    Tests:
+        1. Test retrieving the state to verify `msgpack.unpackb` yields the same data as /portfolio and /portfolio-value.
+        2. Test retrieving the state with an empty portfolio to verify the total value is 0.
+    """
+    try:
+        total_value = await asyncio.to_thread(get_current_portfolio_value, dict(portfolio))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    state = {
+        "portfolio": portfolio,
+        "remaining_capital": float(start_capital),
+        "total_value": float(total_value),
+    }
+    return Response(msgpack.packb(state), media_type="application/msgpack")
+
+
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # The portfolio state lives in this process, so the server must run as a single worker.
+    # loop="auto" selects uvloop where it is installed (not available on Windows).
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="auto", http="httptools", proxy_headers=True)
@@ -5,7 +5,7 @@ This module contains functions to load, save, and manage a financial portfolio.
 It uses `yfinance` to fetch financial data and `pandas` for data processing.
 
 Installation:
-    pip install yfinance pandas
+    pip install yfinance pandas pyarrow orjson cachetools requests-cache
 
 Author: Arthur Simon, MNr: -
 Date: 02.06.2024
@@ -13,16 +13,73 @@ license: free
 version: 0.0.1 (master.major.minor)
 """
 
+import atexit
+import itertools
 import json
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Timer
+import pandas as pd
+import requests_cache
 import yfinance as yf
+from cachetools import TTLCache
 from fastapi import HTTPException
+from requests.adapters import HTTPAdapter
+from data_utils import PORTFOLIO_FILE, history_exists, json_dumps, json_loads, read_portfolio_file, save_history
+
+# Shared HTTP session for yfinance: reuses keep-alive connections to Yahoo and
+# serves identical requests from a local SQLite cache for 60 seconds. Price data from the
+# chart endpoint is never cached, so `invalidate_price` really leads to a fresh quote
+yf_session = requests_cache.CachedSession(
+    "yf_cache",
+    backend="sqlite",
+    expire_after=60,
+    urls_expire_after={"*/v8/finance/chart/*": requests_cache.DO_NOT_CACHE},
+)
+for _host in ("https://query1.finance.yahoo.com", "https://query2.finance.yahoo.com"):
+    yf_session.mount(_host, HTTPAdapter(pool_connections=32, pool_maxsize=32))
+
+# Number of symbols requested from Yahoo in a single download
+BATCH_SIZE = 20
+
+# `yf.download` collects its results in a module-global dict that every call resets, so two
+# concurrent downloads overwrite each other's results and can wait for them forever.
+# Multi-ticker downloads run one at a time; single tickers use `Ticker.history`, which does not need the dict
+_download_lock = Lock()
+
+# Shared pool for per-ticker downloads, kept alive across requests to avoid thread startup costs
+_executor = ThreadPoolExecutor(max_workers=16)
+
+# Short-lived caches for Yahoo lookups, shared by the request threads and guarded by one lock
+_info_cache = TTLCache(maxsize=1024, ttl=60)
+_price_cache = TTLCache(maxsize=4096, ttl=15)
+_cache_lock = Lock()
+
+# Symbol and name per ticker, prefetched on startup; names do not change, so entries never expire
+_symbol_names = {}
+
+# Append-only log of trades since the last snapshot in portfolio.json
+LOG_FILE = "data/portfolio.log"
+# Log size in bytes above which the log is folded into a new snapshot
+LOG_COMPACT_SIZE = 1024 * 1024
+# Seconds after a trade until the trades logged since the last snapshot are folded into a new one
+CHECKPOINT_DELAY = 5
+_log_file = None
+# Guards the log, the pending state and the checkpoint timer against the timer thread
+_log_lock = Lock()
+# The latest logged (start_capital, portfolio) that is not part of the snapshot yet
+_pending_state = None
+_checkpoint_timer = None
 
 
 def load_portfolio() -> tuple:
     """
     Load the portfolio from a JSON file or initialize with default values.
 
+    Trades recorded in the transaction log after the last snapshot are replayed on top of it,
+    and the result is compacted into a new snapshot.
+
     Returns:
         tuple: The starting capital (int) and the portfolio dictionary (dict). -> (int, dict)
 
@@ -33,21 +90,19 @@ def load_portfolio() -> tuple:
     default_capital = 1000000
     default_portfolio = {}
 
-    if os.path.exists("portfolio.json"):
-        try:
-            with open("portfolio.json", "r") as f:
-                saved_data = json.load(f)
-                start_capital = saved_data.get("start_capital", default_capital)
-                portfolio = saved_data.get("portfolio", default_portfolio)
-        except (json.JSONDecodeError, FileNotFoundError):
-            start_capital = default_capital
-            portfolio = default_portfolio
-            save_portfolio(start_capital, portfolio)
-    else:
+    try:
+        saved_data = read_portfolio_file()
+        start_capital = saved_data.get("start_capital", default_capital)
+        portfolio = saved_data.get("portfolio", default_portfolio)
+    except (json.JSONDecodeError, FileNotFoundError):
         start_capital = default_capital
         portfolio = default_portfolio
         save_portfolio(start_capital, portfolio)
 
+    start_capital, replayed = _replay_transactions(start_capital, portfolio)
+    if replayed:
+        compact_portfolio(start_capital, portfolio)
+
     return start_capital, portfolio
 
 
@@ -55,6 +110,9 @@ def save_portfolio(start_capital: int, portfolio: dict) -> None:
     """
     Save the portfolio to a JSON file.
 
+    The file is written to a temporary file next to it and renamed over it, so a crash
+    leaves either the old or the new snapshot but never a partially written one.
+
     Args:
         start_capital (int): The starting capital.
         portfolio (dict): The portfolio dictionary.
@@ -66,13 +124,173 @@ def save_portfolio(start_capital: int, portfolio: dict) -> None:
         1. Test saving a valid portfolio to verify it writes the data correctly.
         2. Test saving with different data structures to verify it handles various edge cases.
     """
-    with open("portfolio.json", "w") as f:
-        json.dump({"start_capital": start_capital, "portfolio": portfolio}, f)
+    directory = os.path.dirname(os.path.abspath(PORTFOLIO_FILE))
+    with tempfile.NamedTemporaryFile("wb", dir=directory, suffix=".tmp", delete=False) as f:
+        f.write(json_dumps({"start_capital": start_capital, "portfolio": portfolio}))
+        # The snapshot must be on disk before the transaction log it replaces is emptied
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f.name, PORTFOLIO_FILE)
+
+
+def _open_log():
+    """
+    Open the transaction log for appending, creating it on first use.
+
+    Returns:
+        io.FileIO: The unbuffered log file. -> io.FileIO
+    """
+    global _log_file
+    if _log_file is None:
+        os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+        _log_file = open(LOG_FILE, "ab", buffering=0)
+    return _log_file
+
+
+def append_transaction(op: str, ticker: str, quantity: int, price: float, start_capital: float, portfolio: dict) -> None:
+    """
+    Record a trade in the transaction log instead of rewriting the whole portfolio file.
+
+    Each record stores the capital and the position in the traded ticker after the trade,
+    so replaying a record more than once yields the same state. The snapshot is rewritten
+    once, CHECKPOINT_DELAY seconds after the first trade of a burst, instead of per trade.
+    The call waits for a running checkpoint to finish, so async callers run it in a worker thread.
+
+    Args:
+        op (str): The kind of trade, "buy" or "sell".
+        ticker (str): The traded ticker.
+        quantity (int): The number of shares traded.
+        price (float): The price per share.
+        start_capital (float): The remaining capital after the trade.
+        portfolio (dict): The portfolio dictionary after the trade.
+
+    Returns:
+        None -> None
+
+    Tests:
+        1. Test appending a trade to verify one JSON line is added to the log.
+        2. Test appending several trades to verify portfolio.json is rewritten once after CHECKPOINT_DELAY.
+    """
+    global _pending_state, _checkpoint_timer
+    record = {
+        "op": op,
+        "ticker": ticker,
+        "qty": quantity,
+        "price": float(price),
+        "cap_after": float(start_capital),
+        "shares_after": portfolio.get(ticker, 0),
+    }
+    with _log_lock:
+        log = _open_log()
+        log.write(json_dumps(record) + b"\n")
+        os.fsync(log.fileno())
+        _pending_state = (float(start_capital), dict(portfolio))
+
+        if os.fstat(log.fileno()).st_size > LOG_COMPACT_SIZE:
+            _compact(*_pending_state)
+        elif _checkpoint_timer is None:
+            _checkpoint_timer = Timer(CHECKPOINT_DELAY, flush_portfolio)
+            _checkpoint_timer.daemon = True
+            _checkpoint_timer.start()
+
+
+def compact_portfolio(start_capital: float, portfolio: dict) -> None:
+    """
+    Write a new portfolio snapshot and empty the transaction log.
+
+    Args:
+        start_capital (float): The remaining capital.
+        portfolio (dict): The portfolio dictionary.
+
+    Returns:
+        None -> None
+
+    Tests:
+        1. Test compacting after several trades to verify portfolio.json matches the in-memory state.
+        2. Test compacting to verify the transaction log is empty afterwards.
+    """
+    with _log_lock:
+        _compact(start_capital, portfolio)
+
+
+def flush_portfolio() -> None:
+    """
+    Fold the trades logged since the last snapshot into a new snapshot, if there are any.
+
+    Called by the checkpoint timer and on interpreter exit.
+
+    Returns:
+        None -> None
+
+    Tests:
+        1. Test flushing after a trade to verify portfolio.json contains it and the log is empty.
+        2. Test flushing without pending trades to verify portfolio.json is not rewritten.
+    """
+    with _log_lock:
+        if _pending_state is not None:
+            _compact(*_pending_state)
+
+
+def _compact(start_capital: float, portfolio: dict) -> None:
+    """
+    Write a new snapshot and empty the transaction log; the caller must hold `_log_lock`.
+
+    Args:
+        start_capital (float): The remaining capital.
+        portfolio (dict): The portfolio dictionary.
+
+    Returns:
+        None -> None
+    """
+    global _pending_state, _checkpoint_timer
+    if _checkpoint_timer is not None:
+        _checkpoint_timer.cancel()
+        _checkpoint_timer = None
+    save_portfolio(start_capital, portfolio)
+    _open_log().truncate(0)
+    _pending_state = None
+
+
+atexit.register(flush_portfolio)
+
+
+def _replay_transactions(start_capital: float, portfolio: dict) -> tuple:
+    """
+    Apply the trades from the transaction log to a loaded snapshot.
+
+    Args:
+        start_capital (float): The capital from the snapshot.
+        portfolio (dict): The portfolio from the snapshot, updated in place.
+
+    Returns:
+        tuple: The capital after the last trade and the number of replayed trades. -> (float, int)
+    """
+    replayed = 0
+    if not os.path.exists(LOG_FILE):
+        return start_capital, replayed
+
+    with open(LOG_FILE, "rb") as f:
+        for line in f:
+            try:
+                record = json_loads(line)
+            except json.JSONDecodeError:
+                # A trade interrupted while being written leaves an incomplete last line
+                break
+            start_capital = record["cap_after"]
+            if record["shares_after"]:
+                portfolio[record["ticker"]] = record["shares_after"]
+            else:
+                portfolio.pop(record["ticker"], None)
+            replayed += 1
+    return start_capital, replayed
 
 
 def fetch_portfolio_data(portfolio: dict) -> None:
     """
-    Fetch data for all tickers in the portfolio and save it as CSV files.
+    Fetch data for all tickers in the portfolio that have no stored data yet and save it to the data directory.
+
+    The missing tickers are downloaded in batches of BATCH_SIZE symbols instead of one request per ticker,
+    tickers missing from a batch response are retried concurrently on the shared thread pool.
 
     Args:
         portfolio (dict): The portfolio dictionary.
@@ -84,15 +302,114 @@ def fetch_portfolio_data(portfolio: dict) -> None:
         1. Test with a valid portfolio to verify it fetches and saves data correctly.
         2. Test with an empty portfolio to verify it handles edge cases.
     """
-    if not os.path.exists("data"):
-        os.makedirs("data")
+    missing = [ticker for ticker in portfolio if not history_exists(ticker)]
+    if not missing:
+        return
+
+    frames = download_batch(missing)
+
+    retry = [ticker for ticker in missing if ticker not in frames]
+    for ticker, data in zip(retry, _executor.map(_download_history, retry)):
+        if not data.empty:
+            frames[ticker] = data
+
+    # Writing the files in parallel overlaps the disk I/O, pyarrow releases the GIL while writing
+    list(_executor.map(save_history, frames.keys(), frames.values()))
+
+
+def _download_history(ticker: str) -> pd.DataFrame:
+    """
+    Download the default history of a single ticker.
+
+    Args:
+        ticker (str): The stock ticker.
+
+    Returns:
+        pd.DataFrame: The downloaded data, empty if the download failed. -> pd.DataFrame
+    """
+    try:
+        return download_history(ticker).dropna(how="all")
+    except Exception:
+        return pd.DataFrame()
+
+
+def download_history(ticker: str, period: str = "max") -> pd.DataFrame:
+    """
+    Download the daily history of a single ticker in the column layout of `yf.download`.
 
-    for ticker in portfolio.keys():
-        file_path = f"data/{ticker}.csv"
-        if not os.path.exists(file_path):
-            data = yf.download(ticker)
-            if not data.empty:
-                data.to_csv(file_path)
+    Args:
+        ticker (str): The stock ticker.
+        period (str): The period to download (default is "max").
+
+    Returns:
+        pd.DataFrame: The downloaded data with a time zone naive index, empty if no data was found. -> pd.DataFrame
+
+    Tests:
+        1. Test with a valid ticker to verify the columns are Open, High, Low, Close, Adj Close and Volume.
+        2. Test with an invalid ticker to verify an empty DataFrame is returned.
+    """
+    data = yf.Ticker(ticker, session=yf_session).history(period=period, auto_adjust=False, actions=False)
+    if isinstance(data.index, pd.DatetimeIndex) and data.index.tz is not None:
+        data.index = data.index.tz_localize(None)
+    return data
+
+
+def download_batch(tickers: list, columns: list = None, **kwargs) -> dict:
+    """
+    Download data for several tickers with one request per batch of BATCH_SIZE symbols.
+
+    Args:
+        tickers (list): The tickers to download.
+        columns (list): The columns to keep per ticker, all columns if None.
+        **kwargs: Additional arguments passed to `yf.download` (e.g. period, interval).
+
+    Returns:
+        dict: The downloaded data per ticker, tickers without any data are omitted. -> {str: pd.DataFrame}
+
+    Tests:
+        1. Test with several valid tickers to verify a DataFrame is returned for each of them.
+        2. Test with a single ticker to verify the flat column layout returned by yfinance is handled.
+    """
+    frames = {}
+    remaining = iter(tickers)
+    while batch := list(itertools.islice(remaining, BATCH_SIZE)):
+        with _download_lock:
+            data = yf.download(
+                batch, group_by="ticker", progress=False, threads=True, session=yf_session, **kwargs
+            )
+        for ticker in batch:
+            if isinstance(data.columns, pd.MultiIndex):
+                if ticker not in data.columns.get_level_values(0):
+                    continue
+                frame = data[ticker]
+            else:
+                frame = data
+            if columns is not None:
+                frame = frame[columns]
+            frame = frame.dropna(how="all")
+            if not frame.empty:
+                frames[ticker] = frame
+    return frames
+
+
+def _fetch_last_close(ticker: str) -> float:
+    """
+    Download the latest one-minute closing price of a single ticker.
+
+    Args:
+        ticker (str): The stock ticker.
+
+    Returns:
+        float: The most recent one-minute closing price. -> float
+
+    Raises:
+        HTTPException: If no data is found for the ticker.
+    """
+    data = yf.Ticker(ticker, session=yf_session).history(period="1d", interval="1m", actions=False)
+    closes = data["Close"].dropna() if not data.empty else data
+    if closes.empty:
+        raise HTTPException(status_code=404, detail=f"Ticker {ticker} not found")
+    return float(closes.to_numpy()[-1])
 
 
 def get_current_portfolio_value(portfolio: dict) -> float:
@@ -112,11 +429,148 @@ def get_current_portfolio_value(portfolio: dict) -> float:
         1. Test with a valid portfolio to verify it calculates the value correctly.
         2. Test with an invalid ticker in the portfolio to verify it raises a 404 HTTPException.
     """
+    with _cache_lock:
+        prices = {ticker: _price_cache[ticker] for ticker in portfolio if ticker in _price_cache}
+
+    missing = [ticker for ticker in portfolio if ticker not in prices]
+    if missing:
+        # One request per BATCH_SIZE tickers; only the closing prices are kept from each response
+        frames = download_batch(missing, columns=["Close"], period="1d", interval="1m")
+        for ticker, frame in frames.items():
+            prices[ticker] = float(frame["Close"].to_numpy()[-1])
+
+        # Retry tickers missing from the batch response with concurrent single-ticker downloads,
+        # so the wait is bounded by the slowest download rather than the sum of all of them
+        retry = [ticker for ticker in missing if ticker not in prices]
+        prices.update(zip(retry, _executor.map(_fetch_last_close, retry)))
+
+        with _cache_lock:
+            _price_cache.update({ticker: prices[ticker] for ticker in missing})
+
     total_value = 0
     for ticker, quantity in portfolio.items():
-        data = yf.download(ticker, period="1d", interval="1m")
-        if data.empty:
-            raise HTTPException(status_code=404, detail=f"Ticker {ticker} not found")
-        current_price = data["Close"].iloc[-1]
-        total_value += current_price * quantity
+        total_value += prices[ticker] * quantity
     return total_value
+
+
+def fetch_symbol_info(query: str) -> dict:
+    """
+    Get the yfinance info for a symbol, served from a cache for up to 60 seconds.
+
+    Args:
+        query (str): The stock symbol to look up.
+
+    Returns:
+        dict: The info dictionary reported by yfinance. -> dict
+
+    Tests:
+        1. Test with a valid symbol (e.g., "AAPL") to verify the info is returned.
+        2. Test repeated lookups of the same symbol to verify only the first one hits Yahoo.
+    """
+    with _cache_lock:
+        info = _info_cache.get(query)
+    if info is None:
+        info = yf.Ticker(query, session=yf_session).info
+        with _cache_lock:
+            _info_cache[query] = info
+    return info
+
+
+def lookup_symbol(query: str) -> dict:
+    """
+    Get the symbol and name of a ticker, from the prefetched names if it is known.
+
+    Args:
+        query (str): The stock symbol to look up.
+
+    Returns:
+        dict: The symbol and name, empty if yfinance reports nothing for the query. -> {"symbol": str, "name": str}
+
+    Tests:
+        1. Test with a prefetched symbol to verify it is returned without hitting Yahoo.
+        2. Test with an unknown symbol to verify it is fetched once and then served from memory.
+    """
+    entry = _symbol_names.get(query)
+    if entry is None:
+        info = fetch_symbol_info(query)
+        if not info:
+            return {}
+        entry = {"symbol": info.get("symbol"), "name": info.get("shortName")}
+        _symbol_names[query] = entry
+    return entry
+
+
+def prefetch_symbol_info(symbols) -> None:
+    """
+    Resolve the names of the given symbols in the background so later searches are dictionary lookups.
+
+    Args:
+        symbols (iterable): The stock symbols to resolve, e.g. the tickers in the portfolio.
+
+    Returns:
+        None -> None
+
+    Tests:
+        1. Test with the portfolio tickers to verify `lookup_symbol` serves them once the lookups finish.
+        2. Test with an invalid symbol to verify the other symbols are still resolved.
+    """
+    symbols = [symbol for symbol in symbols if symbol not in _symbol_names]
+    if not symbols:
+        return
+
+    tickers = yf.Tickers(" ".join(symbols), session=yf_session).tickers
+
+    def resolve(symbol, ticker):
+        try:
+            info = ticker.info
+        except Exception:
+            return
+        if info:
+            _symbol_names[symbol] = {"symbol": info.get("symbol"), "name": info.get("shortName")}
+
+    for symbol, ticker in tickers.items():
+        _executor.submit(resolve, symbol, ticker)
+
+
+def fetch_current_price(ticker: str) -> float:
+    """
+    Get the latest price of a ticker, served from a cache for up to 15 seconds.
+
+    Args:
+        ticker (str): The stock ticker.
+
+    Returns:
+        float: The most recent one-minute closing price. -> float
+
+    Raises:
+        HTTPException: If no data is found for the ticker.
+
+    Tests:
+        1. Test with a valid ticker to verify the latest price is returned.
+        2. Test with an invalid ticker to verify it raises a 404 HTTPException.
+    """
+    with _cache_lock:
+        price = _price_cache.get(ticker)
+    if price is None:
+        price = _fetch_last_close(ticker)
+        with _cache_lock:
+            _price_cache[ticker] = price
+    return price
+
+
+def invalidate_price(ticker: str) -> None:
+    """
+    Drop the cached price of a ticker so the next lookup fetches a fresh quote.
+
+    Args:
+        ticker (str): The stock ticker.
+
+    Returns:
+        None -> None
+
+    Tests:
+        1. Test invalidating a cached ticker to verify the next lookup downloads again.
+        2. Test invalidating an uncached ticker to verify no error is raised.
+    """
+    with _cache_lock:
+        _price_cache.pop(ticker, None)
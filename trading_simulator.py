@@ -4,7 +4,7 @@ Trading Simulator Application
 This module provides a trading simulator application with a graphical user interface using Tkinter.
 
 Installation:
-    pip install tkinter requests pandas matplotlib
+    pip install tkinter requests orjson pandas matplotlib
 
 Author: Arthur Simon, MNr: -
 Date: 02.06.2024
@@ -12,14 +12,25 @@ license: free
 version: 0.0.1 (master.major.minor)
 """
 
+import time
 import tkinter as tk
+from collections import deque
 from tkinter import messagebox, ttk
 import requests
+from requests.adapters import HTTPAdapter
+import orjson
 import pandas as pd
 from datetime import datetime
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from trading_utils import plot_historical_data, plot_portfolio
-import json
+
+API_URL = "http://127.0.0.1:8000"
+# Seconds to wait for the server, as in frontend.py; fetching long histories from Yahoo can be slow
+REQUEST_TIMEOUT = 30
+# Seconds a portfolio response is reused without asking the server again
+PORTFOLIO_MAX_AGE = 1.0
+# Number of portfolio values kept for the plot, one day at one value per minute
+VALUE_HISTORY_SIZE = 1440
 
 
 class TradingSimulator(tk.Tk):
@@ -29,18 +40,21 @@ class TradingSimulator(tk.Tk):
     Attributes:
         remaining_capital (float): The user's available capital for trading.
         portfolio_value (float): The total value of the user's portfolio.
-        portfolio_value_history (list): A list tracking the historical value of the portfolio.
+        portfolio_value_history (collections.deque): The most recent VALUE_HISTORY_SIZE values of the portfolio with their times.
         canvas (tk.Canvas): Canvas for the main GUI layout.
         scrollbar (ttk.Scrollbar): Vertical scrollbar for navigating the canvas content.
         frame (tk.Frame): Frame containing GUI widgets for interacting with the trading simulator.
         valid_periods (list): List of valid time periods for data analysis.
         time_period_var (tk.StringVar): Stores the selected time period for historical data requests.
+        http (requests.Session): Session reusing the connection to the server across requests.
 
     Methods:
         _on_mouse_wheel(event): Handles mouse wheel scrolling for the canvas.
+        _flush_scroll(): Scrolls the canvas by the wheel steps collected since the last scroll.
         create_widgets(): Initializes and places widgets for user input and actions.
-        load_start_capital() -> float: Loads the initial trading capital from a configuration file.
-        load_initial_portfolio(): Fetches the initial portfolio data from the server.
+        load_initial_portfolio(): Fetches the initial portfolio data and remaining capital from the server.
+        fetch_portfolio(max_age) -> tuple: Fetches the portfolio with a conditional request, reusing a fresh or unchanged response.
+        cache_portfolio(portfolio, etag): Stores a portfolio received from the server for reuse.
         search_symbol(): Searches for a stock or cryptocurrency symbol using the provided query.
         get_historical_data(): Retrieves historical data for the specified stock or cryptocurrency symbol.
         on_period_change(event): Updates data when the time period selection changes.
@@ -50,7 +64,7 @@ class TradingSimulator(tk.Tk):
         show_portfolio(): Retrieves and displays the latest portfolio from the server.
         update_portfolio_value(): Periodically updates the total value of the portfolio.
         update_portfolio_list(portfolio: dict): Updates the portfolio holdings displayed in the GUI.
-        uppercase_entry(event): Converts text in the query entry field to uppercase.
+        uppercase_entry(*args): Converts text in the query entry field to uppercase.
     """
 
     def __init__(self):
@@ -65,9 +79,10 @@ class TradingSimulator(tk.Tk):
         self.geometry("800x600")
         self.configure(bg="lightgrey")
 
-        self.remaining_capital = self.load_start_capital()
+        # Set from the server's state by load_initial_portfolio
+        self.remaining_capital = 0
         self.portfolio_value = 0
-        self.portfolio_value_history = []
+        self.portfolio_value_history = deque(maxlen=VALUE_HISTORY_SIZE)
 
         self.canvas = tk.Canvas(self, bg="lightgrey")
         self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -78,10 +93,22 @@ class TradingSimulator(tk.Tk):
         self.canvas.configure(yscrollcommand=self.scrollbar.set)
         self.canvas.bind('<Configure>', lambda e: self.canvas.configure(scrollregion=self.canvas.bbox('all')))
         self.canvas.bind_all("<MouseWheel>", self._on_mouse_wheel)
+        # Wheel steps received since the last scroll, applied together once Tk is idle
+        self._pending_scroll = 0.0
+        self._scroll_scheduled = False
 
         self.frame = tk.Frame(self.canvas, bg="lightgrey")
         self.canvas.create_window((0, 0), window=self.frame, anchor="nw")
 
+        # One keep-alive session for all requests to the server instead of a new connection per request
+        self.http = requests.Session()
+        self.http.mount(API_URL, HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+        # Last portfolio response, its ETag and when it was received, reused while it is fresh or unchanged
+        self._portfolio = None
+        self._portfolio_etag = None
+        self._portfolio_time = 0.0
+
         self.create_widgets()
         self.load_initial_portfolio()
         self.previous_portfolio_value = 0
@@ -92,6 +119,8 @@ class TradingSimulator(tk.Tk):
         """
         Handle mouse wheel scrolling.
 
+        A burst of wheel events is collected and applied as a single scroll when Tk is idle.
+
         Args:
             event: The event object.
 
@@ -102,7 +131,25 @@ class TradingSimulator(tk.Tk):
             1. Scroll with mouse wheel, canvas should scroll.
             2. Scroll with touchpad, canvas should scroll.
         """
-        self.canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
+        self._pending_scroll -= event.delta / 120
+        if not self._scroll_scheduled:
+            self._scroll_scheduled = True
+            self.after_idle(self._flush_scroll)
+
+    def _flush_scroll(self) -> None:
+        """
+        Scroll the canvas by the whole wheel steps collected since the last scroll.
+
+        Fractions of a step, as sent by touchpads, are kept for the next scroll.
+
+        Returns:
+            None
+        """
+        self._scroll_scheduled = False
+        units = int(self._pending_scroll)
+        if units:
+            self._pending_scroll -= units
+            self.canvas.yview_scroll(units, "units")
 
 
     def create_widgets(self) -> None:
@@ -124,10 +171,11 @@ class TradingSimulator(tk.Tk):
         )
         self.label.pack(pady=10)
 
-        self.query_entry = tk.Entry(self.frame, font=("Arial", 12))
+        self.query_var = tk.StringVar()
+        self.query_entry = tk.Entry(self.frame, font=("Arial", 12), textvariable=self.query_var)
         self.query_entry.pack(pady=10)
         self.query_entry.bind("<Return>", lambda event: self.get_historical_data())
-        self.query_entry.bind("<KeyRelease>", self.uppercase_entry)
+        self.query_var.trace_add("write", self.uppercase_entry)
 
         self.search_frame = tk.Frame(self.frame, bg="lightgrey")
         self.search_frame.pack(pady=10)
@@ -226,43 +274,79 @@ class TradingSimulator(tk.Tk):
         self.portfolio_listbox = tk.Listbox(self.frame, font=("Arial", 12), width=50, height=10)
         self.portfolio_listbox.pack(pady=10)
 
-    def load_start_capital(self) -> float:
+    def load_initial_portfolio(self) -> None:
         """
-        Load the starting capital from a configuration file.
+        Load the initial portfolio data and remaining capital from the server.
+
+        The server's state is used instead of portfolio.json, which only catches up with
+        recent trades at the next checkpoint.
+
+        Raises:
+            RuntimeError: If the request to the server fails.
 
         Returns:
-            float: The starting capital.
+            None
 
         Test Cases:
-            1. Ensure the start capital is loaded correctly from the JSON file.
-            2. Handle cases where the file or the 'start_capital' key does not exist.
+            1. Ensure the initial portfolio and remaining capital are loaded and displayed correctly.
+            2. Handle server response errors correctly.
         """
-        with open('portfolio.json', 'r') as f:
-            config = json.load(f)
-        return config['start_capital']
+        portfolio, _ = self.fetch_portfolio()
+        self.remaining_capital = portfolio['remaining_capital']
+        self.capital_label.config(text=f"Remaining Capital: ${self.remaining_capital:.2f}")
+        plot_portfolio(portfolio, self.portfolio_plot_frame, self.portfolio_value_history)
+        self.update_portfolio_list(portfolio['portfolio'])
 
 
-    def load_initial_portfolio(self) -> None:
+    def fetch_portfolio(self, max_age: float = PORTFOLIO_MAX_AGE) -> tuple:
         """
-        Load the initial portfolio data from the server.
+        Get the portfolio from the server with a conditional request.
+
+        A portfolio received less than `max_age` seconds ago, including one returned by a trade,
+        is reused without a request.
+
+        Args:
+            max_age (float): The age in seconds up to which the cached portfolio is reused.
 
         Raises:
             RuntimeError: If the request to the server fails.
 
         Returns:
-            None
+            tuple: The portfolio response and whether it changed since the last request. -> (dict, bool)
 
         Test Cases:
-            1. Ensure the initial portfolio is loaded and displayed correctly.
-            2. Handle server response errors correctly.
+            1. Ensure the first request returns the portfolio as changed.
+            2. Ensure a repeated request without trades in between returns the cached portfolio as unchanged.
+            3. Ensure a call right after a trade uses the portfolio from the trade response without a request.
         """
-        response = requests.get("http://127.0.0.1:8000/portfolio")
-        if response.status_code == 200:
-            portfolio = response.json()
-            plot_portfolio(portfolio, self.portfolio_plot_frame, self.portfolio_value_history)
-            self.update_portfolio_list(portfolio['portfolio'])
-        else:
-            raise RuntimeError(response.json()['detail'])
+        if self._portfolio is not None and time.monotonic() - self._portfolio_time < max_age:
+            return self._portfolio, False
+
+        headers = {"If-None-Match": self._portfolio_etag} if self._portfolio_etag else {}
+        response = self.http.get(f"{API_URL}/portfolio", headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 304:
+            return self._portfolio, False
+        if response.status_code != 200:
+            raise RuntimeError(orjson.loads(response.content)['detail'])
+
+        self.cache_portfolio(orjson.loads(response.content), response.headers.get("ETag"))
+        return self._portfolio, True
+
+
+    def cache_portfolio(self, portfolio: dict, etag: str = None) -> None:
+        """
+        Store a portfolio received from the server for reuse by `fetch_portfolio`.
+
+        Args:
+            portfolio (dict): The portfolio and remaining capital.
+            etag (str): The ETag of the /portfolio response, None for portfolios returned by trades.
+
+        Returns:
+            None
+        """
+        self._portfolio = portfolio
+        self._portfolio_etag = etag
+        self._portfolio_time = time.monotonic()
 
 
     def search_symbol(self) -> None:
@@ -280,16 +364,16 @@ class TradingSimulator(tk.Tk):
             2. Handle server response errors correctly.
         """
         query = self.query_entry.get()
-        response = requests.get(f"http://127.0.0.1:8000/search/{query.upper()}")
+        response = self.http.get(f"{API_URL}/search/{query.upper()}", timeout=REQUEST_TIMEOUT)
         if response.status_code == 200:
-            result = response.json()
+            result = orjson.loads(response.content)
             symbol = result['symbol']
             name = result['name']
             messagebox.showinfo("Search Result", f"Symbol: {symbol}\nName: {name}")
             self.query_entry.delete(0, tk.END)
             self.query_entry.insert(0, symbol)
         else:
-            raise RuntimeError(response.json()['detail'])
+            raise RuntimeError(orjson.loads(response.content)['detail'])
 
 
     def get_historical_data(self) -> None:
@@ -308,12 +392,12 @@ class TradingSimulator(tk.Tk):
         """
         ticker = self.query_entry.get().upper()
         period = self.time_period_var.get()
-        response = requests.get(f"http://127.0.0.1:8000/historical-data/{ticker}?period={period}")
+        response = self.http.get(f"{API_URL}/historical-data/{ticker}?period={period}", timeout=REQUEST_TIMEOUT)
         if response.status_code == 200:
-            messagebox.showinfo("Success", response.json()['message'])
+            messagebox.showinfo("Success", orjson.loads(response.content)['message'])
             plot_historical_data(ticker, period, self.plot_frame)
         else:
-            raise RuntimeError(response.json()['detail'])
+            raise RuntimeError(orjson.loads(response.content)['detail'])
 
 
     def on_period_change(self, event) -> None:
@@ -349,21 +433,25 @@ class TradingSimulator(tk.Tk):
             2. Handle server response errors and invalid input correctly.
         """
         ticker = self.query_entry.get().upper()
-        quantity = self.quantity_entry.get()
-        if not quantity.isdigit():
+        try:
+            quantity = int(self.quantity_entry.get())
+        except ValueError:
+            quantity = 0
+        if quantity <= 0:
             raise ValueError("Please enter a valid quantity.")
-    
-        quantity = int(quantity)
-        response = requests.post(f"http://127.0.0.1:8000/buy", params={"ticker": ticker, "quantity": quantity})
+
+        response = self.http.post(f"{API_URL}/buy", json={"ticker": ticker, "quantity": quantity}, timeout=REQUEST_TIMEOUT)
         if response.status_code == 200:
-            result = response.json()
+            result = orjson.loads(response.content)
             messagebox.showinfo("Success", result['message'])
+            # The trade response carries the new portfolio, so the following refresh needs no request
+            self.cache_portfolio({"portfolio": result['portfolio'], "remaining_capital": result['remaining_capital']})
             self.update_portfolio(result['total_value'], result['remaining_capital'])
             self.update_portfolio_list(result['portfolio'])
         else:
-            if response.json()['detail'] == "Please fetch the historical data for this ticker before making a purchase.":
+            if orjson.loads(response.content)['detail'] == "Please fetch the historical data for this ticker before making a purchase.":
                 self.get_historical_data()
-            raise RuntimeError(response.json()['detail'])
+            raise RuntimeError(orjson.loads(response.content)['detail'])
 
 
     def sell_stock(self) -> None:
@@ -382,19 +470,23 @@ class TradingSimulator(tk.Tk):
             2. Handle server response errors and invalid input correctly.
         """
         ticker = self.query_entry.get().upper()
-        quantity = self.quantity_entry.get()
-        if not quantity.isdigit():
+        try:
+            quantity = int(self.quantity_entry.get())
+        except ValueError:
+            quantity = 0
+        if quantity <= 0:
             raise ValueError("Please enter a valid quantity.")
 
-        quantity = int(quantity)
-        response = requests.post(f"http://127.0.0.1:8000/sell", params={"ticker": ticker, "quantity": quantity})
+        response = self.http.post(f"{API_URL}/sell", json={"ticker": ticker, "quantity": quantity}, timeout=REQUEST_TIMEOUT)
         if response.status_code == 200:
-            result = response.json()
+            result = orjson.loads(response.content)
             messagebox.showinfo("Success", result['message'])
+            # The trade response carries the new portfolio, so the following refresh needs no request
+            self.cache_portfolio({"portfolio": result['portfolio'], "remaining_capital": result['remaining_capital']})
             self.update_portfolio(result['total_value'], result['remaining_capital'])
             self.update_portfolio_list(result['portfolio'])
         else:
-            raise RuntimeError(response.json()['detail'])
+            raise RuntimeError(orjson.loads(response.content)['detail'])
 
 
     def update_portfolio(self, total_value: float, remaining_capital: float) -> None:
@@ -432,13 +524,10 @@ class TradingSimulator(tk.Tk):
             1. Ensure the portfolio is displayed correctly.
             2. Handle server response errors correctly.
         """
-        response = requests.get("http://127.0.0.1:8000/portfolio")
-        if response.status_code == 200:
-            portfolio = response.json()
-            plot_portfolio(portfolio, self.portfolio_plot_frame, self.portfolio_value_history)
+        portfolio, changed = self.fetch_portfolio()
+        plot_portfolio(portfolio, self.portfolio_plot_frame, self.portfolio_value_history)
+        if changed:
             self.update_portfolio_list(portfolio['portfolio'])
-        else:
-            raise RuntimeError(response.json()['detail'])
 
 
     def update_portfolio_value(self) -> None:
@@ -455,9 +544,9 @@ class TradingSimulator(tk.Tk):
             1. Ensure the portfolio value is updated correctly at regular intervals.
             2. Handle server response errors correctly.
         """
-        response = requests.get("http://127.0.0.1:8000/portfolio-value")
+        response = self.http.get(f"{API_URL}/portfolio-value", timeout=REQUEST_TIMEOUT)
         if response.status_code == 200:
-            total_invested_value = response.json()['total_value']
+            total_invested_value = orjson.loads(response.content)['total_value']
             self.portfolio_value_label.config(text=f"Portfolio Value: ${total_invested_value:.2f}")
 
             change = total_invested_value - self.previous_portfolio_value
@@ -470,11 +559,15 @@ class TradingSimulator(tk.Tk):
 
             self.previous_portfolio_value = total_invested_value
 
-            portfolio_response = requests.get("http://127.0.0.1:8000/portfolio")
-            if portfolio_response.status_code == 200:
-                portfolio = portfolio_response.json()
+            try:
+                portfolio, portfolio_changed = self.fetch_portfolio()
+            except RuntimeError:
+                portfolio = None
+            if portfolio is not None:
                 self.portfolio_value_history.append((datetime.now(), total_invested_value))
-                plot_portfolio(portfolio, self.portfolio_plot_frame, self.portfolio_value_history)
+                # Skip the re-plot when neither the holdings nor the value (to the cent) changed
+                if portfolio_changed or abs(change) >= 0.005:
+                    plot_portfolio(portfolio, self.portfolio_plot_frame, self.portfolio_value_history)
 
         self.after(60000, self.update_portfolio_value)
 
@@ -498,23 +591,27 @@ class TradingSimulator(tk.Tk):
             self.portfolio_listbox.insert(tk.END, f"{ticker}: {quantity} shares")
 
 
-    def uppercase_entry(self) -> None:
+    def uppercase_entry(self, *args) -> None:
         """
-        Convert the entry text to uppercase.
+        Convert the entry text to uppercase whenever the query variable is written.
 
         Args:
-            event: The event object.
+            *args: The variable name, index and operation passed by the Tk trace.
 
         Returns:
             None
 
         Test Cases:
             1. Ensure the entry text is converted to uppercase correctly.
-            2. Verify no errors occur during conversion.
+            2. Verify the cursor stays in place when typing in the middle of the text.
         """
-        content = self.query_entry.get()
-        self.query_entry.delete(0, tk.END)
-        self.query_entry.insert(0, content.upper())
+        content = self.query_var.get()
+        upper = content.upper()
+        # Setting the variable runs this trace again, which then finds nothing left to change
+        if upper != content:
+            cursor = self.query_entry.index(tk.INSERT)
+            self.query_var.set(upper)
+            self.query_entry.icursor(cursor)
 
 
 if __name__ == "__main__":
@@ -4,7 +4,7 @@ Trading Utilities Module
 This module provides utility functions for plotting historical data and portfolio information.
 
 Installation:
-    pip install pandas matplotlib tkinter
+    pip install numpy pandas pyarrow matplotlib tkinter
 
 Author: Arthur Simon, MNr: -
 Date: 02.06.2024
@@ -12,12 +12,45 @@ license: free
 version: 0.0.1 (master.major.minor)
 """
 
-import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import ScalarFormatter
 import tkinter as tk
 from tkinter import messagebox
 import datetime
+from data_utils import load_history
+
+# Figure, axes, line and canvas per plot frame, created by the first plot into the frame
+_plots = {}
+
+
+def _get_plot(plot_frame: tk.Frame) -> tuple:
+    """
+    Get the plot embedded in a frame, creating it on first use.
+
+    Args:
+        plot_frame (tk.Frame): The Tkinter frame to embed the plot.
+
+    Returns:
+        tuple: The figure, axes, line and canvas of the plot. -> (Figure, Axes, Line2D, FigureCanvasTkAgg)
+    """
+    key = str(plot_frame)
+    if key not in _plots:
+        for widget in plot_frame.winfo_children():
+            widget.destroy()
+
+        fig = Figure(figsize=(10, 5))
+        ax = fig.add_subplot(111)
+        line, = ax.plot([], [])
+        ax.xaxis_date()
+        ax.set_xlabel("Date")
+        ax.grid(True)
+
+        canvas = FigureCanvasTkAgg(fig, master=plot_frame)
+        canvas.get_tk_widget().pack()
+        _plots[key] = (fig, ax, line, canvas)
+    return _plots[key]
 
 
 def plot_historical_data(ticker: str, period: str, plot_frame: tk.Frame) -> None:
@@ -39,34 +72,29 @@ def plot_historical_data(ticker: str, period: str, plot_frame: tk.Frame) -> None
         1. Test with valid ticker and period, plot should be displayed without error.
         2. Test with invalid ticker, should raise FileNotFoundError and display an error message.
     """
-    for widget in plot_frame.winfo_children():
-        widget.destroy()
-
     try:
-        data = pd.read_csv(f"data/{ticker}.csv", index_col="Date", parse_dates=True)
-        fig, ax = plt.subplots(figsize=(10, 5))
-        data["Close"].plot(ax=ax, title=f"{ticker} Closing Prices")
-        ax.set_xlabel("Date")
-        ax.set_ylabel("Price")
-        ax.grid(True)
-
-        canvas = FigureCanvasTkAgg(fig, master=plot_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack()
-
-        plt.close(fig)
+        data = load_history(ticker, columns=["Close"])
     except FileNotFoundError:
         messagebox.showerror("Error", "Historical data file not found. Please fetch the data first.")
+        return
+
+    fig, ax, line, canvas = _get_plot(plot_frame)
+    line.set_data(data.index, data["Close"])
+    ax.set_title(f"{ticker} Closing Prices")
+    ax.set_ylabel("Price")
+    ax.relim()
+    ax.autoscale_view()
+    canvas.draw_idle()
 
 
-def plot_portfolio(portfolio: dict, portfolio_plot_frame: tk.Frame, portfolio_value_history: list) -> None:
+def plot_portfolio(portfolio: dict, portfolio_plot_frame: tk.Frame, portfolio_value_history) -> None:
     """
     Plot the portfolio value over time.
 
     Args:
         portfolio (dict): The current portfolio holdings.
         portfolio_plot_frame (tk.Frame): The Tkinter frame to embed the plot.
-        portfolio_value_history (list): The history of portfolio values over time.
+        portfolio_value_history (collections.deque): The (time, value) pairs of the portfolio value over time.
 
     Returns:
         None
@@ -75,37 +103,34 @@ def plot_portfolio(portfolio: dict, portfolio_plot_frame: tk.Frame, portfolio_va
         1. Test with non-empty portfolio, plot should display correctly.
         2. Test with empty portfolio, plot should display an empty graph with correct titles.
     """
-    for widget in portfolio_plot_frame.winfo_children():
-        widget.destroy()
+    fig, ax, line, canvas = _get_plot(portfolio_plot_frame)
+    ax.set_ylabel("Value")
 
-    tickers = list(portfolio['portfolio'].keys())
-    fig, ax = plt.subplots(figsize=(10, 5))
-
-    if not tickers:
-        ax.plot([datetime.datetime.now()], [0], label="Invested Value")
+    if not portfolio['portfolio']:
+        line.set_data([datetime.datetime.now()], [0])
+        line.set_label("Invested Value")
         ax.set_title("Total Invested Value Over Time")
-        ax.set_xlabel("Date")
-        ax.set_ylabel("Value")
+        ax.yaxis.set_major_formatter(ScalarFormatter())
         ax.legend()
-        ax.grid(True)
+        ax.relim()
+        ax.autoscale_view()
     else:
-        for ticker in tickers:
-            quantity = portfolio['portfolio'][ticker]
-            data = pd.read_csv(f"data/{ticker}.csv", index_col="Date", parse_dates=True)
-            current_price = data['Close'].iloc[-1]
-
+        legend = ax.get_legend()
+        if legend is not None:
+            legend.remove()
         if portfolio_value_history:
-            times, values = zip(*portfolio_value_history)
-            ax.plot(times, values, label="Portfolio Value")
-            ax.set_ylim(min(values) * 0.95, max(values) * 1.05)
+            # Typed arrays let matplotlib convert the data without inspecting every element
+            count = len(portfolio_value_history)
+            times = np.fromiter((t for t, _ in portfolio_value_history), dtype="datetime64[us]", count=count)
+            values = np.fromiter((v for _, v in portfolio_value_history), dtype=np.float64, count=count)
+            line.set_data(times, values)
+            line.set_label("Portfolio Value")
+            ax.relim()
+            ax.autoscale_view(scaley=False)
+            ax.set_ylim(values.min() * 0.95, values.max() * 1.05)
+        else:
+            line.set_data([], [])
         ax.set_title("Portfolio Value Over Time")
-        ax.set_xlabel("Date")
-        ax.set_ylabel("Value")
         ax.yaxis.set_major_formatter('${x:,.2f}')
-        ax.grid(True)
-
-    canvas = FigureCanvasTkAgg(fig, master=portfolio_plot_frame)
-    canvas.draw()
-    canvas.get_tk_widget().pack()
 
-    plt.close(fig)
+    canvas.draw_idle()